@@ -5,12 +5,14 @@
 # st.title("RetailRadar: Real-Time Reddit Sentiment Dashboard for Stocks")
 # st.write("Welcome! This dashboard will let you explore Reddit sentiment for your favorite stocks in real time.")
 
+import os
+import duckdb
 import streamlit as st
 import pandas as pd
-import sqlite3
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from database_manager import export_posts_to_parquet
 from stock_price_analyzer import (
     get_sentiment_price_comparison, 
     calculate_sentiment_price_correlation, 
@@ -26,25 +28,91 @@ st.set_page_config(
 )
 
 # --- Database Connection & Data Loading ---
-@st.cache_data(ttl=600) # Cache data for 10 minutes
-def load_data():
-    """Loads post data from the SQLite database into a pandas DataFrame."""
-    try:
-        conn = sqlite3.connect("reddit_posts.db")
-        # Load the data, converting the timestamp to a readable datetime format
-        df = pd.read_sql_query("SELECT * FROM posts", conn)
-        df['created_utc'] = pd.to_datetime(df['created_utc'], unit='s')
-        return df
-    except Exception as e:
-        st.error(f"Error loading data: {e}")
-        return pd.DataFrame() # Return empty dataframe on error
+DB_NAME = "reddit_posts.db"
+# Columnar copy of the posts table, exported by main.py after each update cycle
+POSTS_PARQUET = "posts.parquet"
+# Only the columns the dashboard uses; skipping selftext keeps the frame small
+POST_COLUMNS = "id, title, epoch_ms(created_utc * 1000) AS created_utc, tickers, sentiment, sentiment_score"
+
+def get_db_mtime():
+    """Returns when the database last changed, counting writes still in its WAL file."""
+    paths = [DB_NAME, DB_NAME + "-wal"]
+    # An empty WAL file only means a connection was opened (e.g. by the price analysis)
+    return max(
+        (os.path.getmtime(path) for path in paths if os.path.exists(path) and os.path.getsize(path) > 0),
+        default=0
+    )
+
+def query_posts(query, params=()):
+    """Runs a DuckDB query against the posts Parquet file, referenced as `posts`."""
+    # A connection per query, since DuckDB connections can't be shared across Streamlit's threads
+    with duckdb.connect() as con:
+        con.execute(f"CREATE VIEW posts AS SELECT * FROM read_parquet('{POSTS_PARQUET}')")
+        return con.execute(query, params).df()
+
+def build_ticker_index(tickers_column):
+    """Maps each ticker to the row positions of the posts that mention it."""
+    ticker_index = {}
+    for position, tickers in enumerate(tickers_column.fillna('')):
+        for ticker in tickers.split(','):
+            ticker = ticker.strip()
+            if ticker:
+                ticker_index.setdefault(ticker, []).append(position)
+    return ticker_index
+
+@st.cache_data # Keyed on db_mtime, so the cache is only invalidated when the database changes
+def load_data(db_mtime):
+    """
+    Loads post data from the Parquet export into a pandas DataFrame,
+    along with an index from each ticker to the rows that mention it.
+    Errors are raised rather than returned, since st.cache_data doesn't cache exceptions.
+    """
+    # Refresh the export if the database was updated outside of main.py
+    if not os.path.exists(POSTS_PARQUET) or os.path.getmtime(POSTS_PARQUET) < db_mtime:
+        export_posts_to_parquet(DB_NAME, POSTS_PARQUET)
+    df = query_posts(f"SELECT {POST_COLUMNS} FROM posts")
+    return df, build_ticker_index(df['tickers'])
+
+@st.cache_data # Keyed on db_mtime, like load_data
+def load_tickers(db_mtime):
+    """Returns the sorted list of unique tickers mentioned in the database."""
+    # Each distinct comma-separated combination only needs to be split once
+    rows = query_posts("SELECT DISTINCT tickers FROM posts WHERE tickers IS NOT NULL")['tickers']
+    return sorted({ticker.strip() for tickers in rows for ticker in tickers.split(',') if ticker.strip()})
+
+@st.cache_data # Keyed on db_mtime, like load_data
+def load_daily_stats(ticker, db_mtime):
+    """
+    Returns the daily average sentiment and mention count for a ticker, one row per day
+    from its first to its last mention, with days without scores interpolated.
+    """
+    daily = query_posts(
+        """
+        SELECT date_trunc('day', epoch_ms(created_utc * 1000)) AS created_utc,
+               avg(sentiment_score) AS "Average Sentiment",
+               count(*) AS "Mentions"
+        FROM posts
+        WHERE list_contains(string_split(tickers, ','), ?)
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        [ticker],
+    ).set_index('created_utc').asfreq('D')
+    daily['Average Sentiment'] = daily['Average Sentiment'].interpolate()
+    daily['Mentions'] = daily['Mentions'].fillna(0).astype(int)
+    return daily.reset_index()
 
 # --- Main Application ---
 st.title("🔎 RetailRadar: Reddit Sentiment Dashboard")
 st.markdown("Analyze real-time sentiment trends for stocks mentioned on Reddit.")
 
-# Load the data
-df = load_data()
+# Load the data (cached until the database changes)
+db_mtime = get_db_mtime()
+try:
+    df, ticker_index = load_data(db_mtime)
+except Exception as e:
+    st.error(f"Error loading data: {e}")
+    df, ticker_index = pd.DataFrame(), {} # Empty dataframe on error; the next rerun retries
 
 # Check if data is loaded
 if df.empty:
@@ -59,30 +127,21 @@ else:
 
     # --- Ticker Selection ---
     # First, get a unique list of all tickers mentioned in the database
-    all_tickers = df['tickers'].str.split(',').explode().str.strip().unique()
+    all_tickers = load_tickers(db_mtime)
     selected_ticker = st.selectbox("Enter or select a stock ticker:", options=all_tickers)
 
     # Filter the DataFrame to only include posts that mention the selected ticker
-    ticker_df = df[df['tickers'].str.contains(selected_ticker, na=False)].copy()
+    # (an exact lookup, so e.g. 'AA' does not match posts about 'AAPL')
+    ticker_df = df.iloc[ticker_index.get(selected_ticker, [])].copy()
     
     if ticker_df.empty:
         st.warning(f"No posts found for ticker: {selected_ticker}")
     else:
         st.header(f"Sentiment Analysis for ${selected_ticker}")
 
-        # --- Resample Data for Charting ---
-        # We group data by day to get daily average sentiment and mention volume
-        ticker_df.set_index('created_utc', inplace=True)
-        daily_sentiment = ticker_df['sentiment_score'].resample('D').mean()
-        daily_volume = ticker_df['id'].resample('D').count()
-
-        daily_sentiment = daily_sentiment.interpolate()
-
-        # Create a new DataFrame for charting
-        chart_df = pd.DataFrame({
-            'Average Sentiment': daily_sentiment,
-            'Mentions': daily_volume
-        }).reset_index()
+        # --- Daily Aggregates for Charting ---
+        # DuckDB groups the ticker's posts by day to get daily average sentiment and mention volume
+        chart_df = load_daily_stats(selected_ticker, db_mtime)
 
 
         # --- Sentiment Over Time Line Chart ---
@@ -259,4 +318,6 @@ else:
 
         # --- Display Recent Posts ---
         st.subheader("Recent Posts Mentioning this Ticker")
-        st.dataframe(ticker_df[['title', 'sentiment', 'sentiment_score']].sort_index(ascending=False).head(10))
+        # nlargest selects the 10 newest posts without sorting the whole slice
+        recent_posts = ticker_df.nlargest(10, 'created_utc').set_index('created_utc')
+        st.dataframe(recent_posts[['title', 'sentiment', 'sentiment_score']])
@@ -1,23 +1,109 @@
+import os
 import sqlite3
+import threading
 import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Row layout of the posts table as a NumPy structured dtype. The numeric columns are
+# nullable on older databases, so they are read as floats and NULLs read as NaN
+POST_DTYPE = np.dtype([
+    ('id', 'O'),
+    ('title', 'O'),
+    ('selftext', 'O'),
+    ('author', 'O'),
+    ('created_utc', 'f8'),
+    ('upvotes', 'f8'),
+    ('tickers', 'O'),
+    ('sentiment', 'O'),
+    ('sentiment_score', 'f8'),
+])
+
+# Parquet schema of the exported posts; every column is nullable
+POST_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('title', pa.string()),
+    ('selftext', pa.string()),
+    ('author', pa.string()),
+    ('created_utc', pa.int64()),
+    ('upvotes', pa.int64()),
+    ('tickers', pa.string()),
+    ('sentiment', pa.string()),
+    ('sentiment_score', pa.float64()),
+])
+
+def get_connection(db_name="reddit_posts.db", check_same_thread=True):
+    """
+    Opens a connection to the database with WAL journaling and pragmas tuned for bulk writes.
+    """
+    conn = sqlite3.connect(db_name, check_same_thread=check_same_thread)
+    # Larger pages fit more of the clustered posts rows (with their selftext), and
+    # incremental auto_vacuum lets delete_old_posts hand freed pages back to the OS.
+    # Both only take effect on a new database: page_size must come first, and both
+    # must come before journal_mode, which initializes the file. They are skipped on
+    # existing databases, where setting auto_vacuum would write a page on every open
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        conn.execute("PRAGMA page_size=8192")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")  # 64 MB page cache
+    return conn
+
+# Long-lived connections, one per database file, opened on first use
+_shared_connections = {}
+_shared_connections_lock = threading.Lock()
+
+def get_shared_connection(db_name="reddit_posts.db"):
+    """Returns the shared connection to db_name, opening it with WAL pragmas on first use."""
+    with _shared_connections_lock:
+        if db_name not in _shared_connections:
+            _shared_connections[db_name] = get_connection(db_name, check_same_thread=False)
+        return _shared_connections[db_name]
+
+def close_shared_connections():
+    """
+    Closes the shared connections. Closing the last connection to a database checkpoints
+    its WAL into the main file, so do this before anything that compares file mtimes.
+    """
+    with _shared_connections_lock:
+        for conn in _shared_connections.values():
+            conn.close()
+        _shared_connections.clear()
 
 def delete_old_posts(db_name="reddit_posts.db", days_to_keep=90):
     """
     Deletes posts from the database that are older than a specified number of days.
     """
     print(f"--- Running Database Cleanup: Deleting posts older than {days_to_keep} days ---")
+    conn = None
     try:
-        conn = sqlite3.connect(db_name)
+        conn = get_connection(db_name)
         c = conn.cursor()
 
         # Calculate the timestamp for the cutoff date
         cutoff_timestamp = time.time() - (days_to_keep * 24 * 60 * 60)
 
-        # Execute the delete command
+        # Drop cached token ids of the posts about to be removed: a range seek on
+        # idx_created_utc, then primary-key seeks into post_tokens
+        c.execute(
+            "DELETE FROM post_tokens WHERE id IN (SELECT id FROM posts WHERE created_utc < ?)",
+            (cutoff_timestamp,)
+        )
+
+        # Execute the delete command (a range seek on idx_created_utc)
         c.execute("DELETE FROM posts WHERE created_utc < ?", (cutoff_timestamp,))
         
         rows_deleted = c.rowcount
+        c.execute("DELETE FROM post_tickers WHERE created_utc < ?", (cutoff_timestamp,))  # Range seek on idx_post_tickers_created_utc
         conn.commit()
+
+        # Release the freed pages; a no-op unless the database uses incremental auto-vacuum.
+        # executescript steps the pragma to completion (execute would free a single page)
+        if rows_deleted > 0:
+            conn.executescript("PRAGMA incremental_vacuum;")
         
         print(f"Cleanup complete. Deleted {rows_deleted} old posts.")
 
@@ -27,6 +113,43 @@ def delete_old_posts(db_name="reddit_posts.db", days_to_keep=90):
         if conn:
             conn.close()
 
+def iter_posts_chunks(conn, chunk=10_000):
+    """
+    Streams the posts table as NumPy structured arrays of at most chunk rows (POST_DTYPE),
+    so full scans hold one chunk in memory instead of the whole table.
+    """
+    cursor = conn.execute(f"SELECT {', '.join(POST_DTYPE.names)} FROM posts")
+    while rows := cursor.fetchmany(chunk):
+        yield np.array(rows, dtype=POST_DTYPE)
+
+def export_posts_to_parquet(db_name="reddit_posts.db", parquet_name="posts.parquet"):
+    """
+    Exports the posts table to a Parquet file for the dashboard's columnar reads.
+    """
+    conn = sqlite3.connect(db_name)
+    # Write to a temporary file first so the dashboard never reads a partial file
+    partial_name = f"{parquet_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    exported = 0
+    try:
+        with pq.ParquetWriter(partial_name, POST_SCHEMA) as writer:
+            # One row group per chunk; NaNs are written as nulls, and the float-read
+            # integer columns are cast back to nullable int64
+            for rows in iter_posts_chunks(conn):
+                writer.write_table(pa.table(
+                    [pa.array(rows[field.name], from_pandas=True).cast(field.type)
+                     for field in POST_SCHEMA],
+                    schema=POST_SCHEMA
+                ))
+                exported += len(rows)
+    except Exception:
+        if os.path.exists(partial_name):
+            os.remove(partial_name)
+        raise
+    finally:
+        conn.close()
+    os.replace(partial_name, parquet_name)
+    print(f"Exported {exported} posts to {parquet_name}.")
+
 if __name__ == "__main__":
     # Example of how to run it manually for testing
     # Deletes posts older than 30 days
@@ -1,6 +1,6 @@
 from reddit_scraper import run_scraper
 from sentiment_analyzer import analyze_and_update_db
-from database_manager import delete_old_posts
+from database_manager import close_shared_connections, delete_old_posts, export_posts_to_parquet
 import time
 
 def run_update_cycle():
@@ -23,6 +23,12 @@ def run_update_cycle():
     
     # 3. Clean up posts older than 90 days to keep the database fresh
     delete_old_posts(days_to_keep=90)
+
+    # 4. Export the posts to Parquet for the dashboard. The shared connections are closed
+    # first, so their WAL is checkpointed now rather than at exit, which would leave the
+    # database newer than the export and make the dashboard export it again
+    close_shared_connections()
+    export_posts_to_parquet()
     
     print("\nUPDATE CYCLE COMPLETE.\n")
 
@@ -1,24 +1,22 @@
-import praw
+import asyncio
+import asyncpraw
 from dotenv import load_dotenv
 import os
-import re
 import csv
-from store_posts import create_db, insert_post
+import pickle
+import string
+import ahocorasick
+from store_posts import create_db, insert_posts
 
 # Load environment variables from .env file
 load_dotenv()
 
-# PRAW setup
-reddit = praw.Reddit(
-    client_id=os.getenv("REDDIT_CLIENT_ID"),
-    client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
-    user_agent=os.getenv("REDDIT_USER_AGENT"),
-    username=os.getenv("REDDIT_USERNAME"),
-    password=os.getenv("REDDIT_PASSWORD")
-)
+WRITE_BATCH_SIZE = 200  # Number of posts inserted per transaction
+FLUSH = "flush"  # Queued by a scraper when its subreddit is done, so its posts are saved promptly
+ASCII_LOWERCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
 
-def load_tickers_and_names_from_csv(csv_filename):
-    """Loads tickers and a name-to-ticker map from the CSV."""
+def _parse_tickers_csv(csv_filename):
+    """Parses tickers and a name-to-ticker map from the CSV."""
     tickers = set()
     name_map = {}
     with open(csv_filename, newline='') as csvfile:
@@ -37,100 +35,132 @@ def load_tickers_and_names_from_csv(csv_filename):
                     clean_name = name.split(' ')[0].replace('.', '').replace(',', '')
                     name_map[clean_name.lower()] = symbol # Store in lowercase for case-insensitive matching
 
+    return frozenset(tickers), name_map
+
+def load_tickers_and_names_from_csv(csv_filename):
+    """
+    Loads tickers and a name-to-ticker map from the CSV.
+    The parsed result is pickled next to the CSV and reused until the CSV is modified.
+    """
+    cache_filename = os.path.splitext(csv_filename)[0] + ".pkl"
+    if os.path.exists(cache_filename) and os.path.getmtime(cache_filename) >= os.path.getmtime(csv_filename):
+        with open(cache_filename, "rb") as f:
+            tickers, name_map = pickle.load(f)
+    else:
+        tickers, name_map = _parse_tickers_csv(csv_filename)
+        with open(cache_filename, "wb") as f:
+            pickle.dump((tickers, name_map), f, protocol=pickle.HIGHEST_PROTOCOL)
+
     print(f"Loaded {len(tickers)} tickers and {len(name_map)} company names.")
     return tickers, name_map
 
-def extract_tickers(text, valid_tickers, name_map):
-    """Extracts tickers based on symbols AND company names."""
+def build_ticker_automaton(valid_tickers, name_map):
+    """
+    Builds a single Aho-Corasick automaton, run over ASCII-lowercased text, that finds both
+    explicit tickers (e.g., $TSLA, AAPL) and company names. Each lowercased pattern maps to
+    the ticker it spells, which only counts when written in uppercase, and to the tickers of
+    the company names it spells, which match in any case.
+    """
+    patterns = {}
+    for symbol in valid_tickers:
+        patterns.setdefault(symbol.lower(), [None, set()])[0] = symbol
+    for name, symbol in name_map.items():
+        patterns.setdefault(name.lower(), [None, set()])[1].add(symbol)
+
+    automaton = ahocorasick.Automaton()
+    for pattern, (symbol, name_symbols) in patterns.items():
+        automaton.add_word(pattern, (len(pattern), symbol, tuple(name_symbols)))
+    automaton.make_automaton()
+    return automaton
+
+def _is_whole_word(text, start, end):
+    """Checks that text[start:end] is not part of a longer word."""
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+def extract_tickers(text, ticker_automaton):
+    """Extracts tickers based on symbols AND company names, in one pass over the text."""
     found_tickers = set()
-    
-    # 1. Find explicit tickers (e.g., $TSLA, AAPL)
-    # Using a more robust regex for tickers
-    for match in re.findall(r'\b[A-Z]{1,5}\b', text):
-        if match in valid_tickers:
-            found_tickers.add(match)
-            
-    # 2. Find company names from our map
-    # We iterate through the text word by word for simplicity
-    for word in text.lower().split():
-        if word in name_map:
-            found_tickers.add(name_map[word])
-            
+    if len(ticker_automaton):
+        # ASCII-only lowercasing keeps offsets into the original text valid
+        lowered = text.translate(ASCII_LOWERCASE)
+        for end, (length, symbol, name_symbols) in ticker_automaton.iter(lowered):
+            start = end - length + 1
+            if _is_whole_word(text, start, end + 1):
+                if symbol is not None and text[start:end + 1] == symbol:
+                    found_tickers.add(symbol)
+                found_tickers.update(name_symbols)
     return found_tickers
 
-def run_scraper(subreddits, limit_per_subreddit=100):
+async def scrape_subreddit(reddit, subreddit_name, limit, ticker_automaton, queue):
     """
-    Scrapes specified subreddits for new posts, extracts tickers, and saves them to the database.
+    Fetches the newest posts from one subreddit and queues those that mention a ticker.
     """
-    print("--- Starting Reddit Scraper ---")
-    # PRAW setup (it's better to initialize it inside the function if you run this as a long-term job)
-    reddit = praw.Reddit(
+    print(f"Scraping r/{subreddit_name}...")
+    subreddit = await reddit.subreddit(subreddit_name)
+    async for post in subreddit.new(limit=limit):
+        full_text = f"{post.title} {getattr(post, 'selftext', '')}"
+        tickers = extract_tickers(full_text, ticker_automaton)
+        if tickers:
+            await queue.put((post, tickers))
+    await queue.put(FLUSH)
+
+async def write_posts(queue):
+    """
+    Drains the queue and saves posts in batches. Returns the number of new posts saved.
+    """
+    new_posts_found = 0
+    batch = []
+    while True:
+        item = await queue.get()
+        if item is None:  # All scrapers are done
+            break
+        if item != FLUSH:
+            batch.append(item)
+        if batch and (item == FLUSH or len(batch) >= WRITE_BATCH_SIZE):
+            new_posts_found += insert_posts(batch)
+            batch = []
+    if batch:
+        new_posts_found += insert_posts(batch)
+    return new_posts_found
+
+async def scrape_all(subreddits, limit_per_subreddit):
+    """
+    Scrapes all subreddits concurrently while a single writer saves their posts.
+    """
+    valid_tickers, name_to_ticker_map = load_tickers_and_names_from_csv('nasdaq-listed-symbols.csv')
+    ticker_automaton = build_ticker_automaton(valid_tickers, name_to_ticker_map)
+    create_db()  # Ensure DB and table exist
+
+    queue = asyncio.Queue()
+    writer = asyncio.create_task(write_posts(queue))
+    # PRAW setup (initialized inside the function so each run gets its own session)
+    async with asyncpraw.Reddit(
         client_id=os.getenv("REDDIT_CLIENT_ID"),
         client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
         user_agent=os.getenv("REDDIT_USER_AGENT"),
         username=os.getenv("REDDIT_USERNAME"),
         password=os.getenv("REDDIT_PASSWORD")
-    )
-
-    valid_tickers, name_to_ticker_map = load_tickers_and_names_from_csv('nasdaq-listed-symbols.csv')
-    create_db()  # Ensure DB and table exist
-
-    new_posts_found = 0
-    for subreddit_name in subreddits:
-        print(f"Scraping r/{subreddit_name}...")
-        subreddit = reddit.subreddit(subreddit_name)
-        for post in subreddit.new(limit=limit_per_subreddit):
-            full_text = f"{post.title} {getattr(post, 'selftext', '')}"
-            tickers = extract_tickers(full_text, valid_tickers, name_to_ticker_map)
-            
-            if tickers:
-                # The insert_post function returns the number of rows inserted (1 if new, 0 if ignored)
-                rows_inserted = insert_post(post, tickers)
-                if rows_inserted > 0:
-                    new_posts_found += 1
-                    print(f"  -> Saved new post: {post.title} | Tickers: {tickers}")
+    ) as reddit:
+        try:
+            await asyncio.gather(*[
+                scrape_subreddit(reddit, name, limit_per_subreddit, ticker_automaton, queue)
+                for name in subreddits
+            ])
+        finally:
+            # Let the writer flush whatever was scraped, even if a subreddit failed
+            await queue.put(None)
+            new_posts_found = await writer
+    return new_posts_found
 
+def run_scraper(subreddits, limit_per_subreddit=100):
+    """
+    Scrapes specified subreddits for new posts, extracts tickers, and saves them to the database.
+    """
+    print("--- Starting Reddit Scraper ---")
+    new_posts_found = asyncio.run(scrape_all(subreddits, limit_per_subreddit))
     print(f"--- Scraper Finished. Found {new_posts_found} new posts. ---")
 
 if __name__ == "__main__":
     # This block runs only when you execute reddit_scraper.py directly
     # It's useful for a one-off manual run.
     run_scraper(subreddits=["stocks", "wallstreetbets"], limit_per_subreddit=100)
-
-# sentiment analysis from here
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
-
-# Load FinBERT model and tokenizer (do this once at the start)
-tokenizer = AutoTokenizer.from_pretrained("yiyanghkust/finbert-tone")
-model = AutoModelForSequenceClassification.from_pretrained("yiyanghkust/finbert-tone")
-
-def get_sentiment(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        probs = torch.nn.functional.softmax(outputs.logits, dim=1)
-        labels = ['negative', 'neutral', 'positive']
-        sentiment = labels[probs.argmax()]
-        score = probs.max().item()
-    return sentiment, score
-
-import sqlite3
-
-def add_sentiment_to_db(db_name="reddit_posts.db"):
-    conn = sqlite3.connect(db_name)
-    c = conn.cursor()
-    # Add sentiment columns if not present
-    c.execute("ALTER TABLE posts ADD COLUMN sentiment TEXT")
-    c.execute("ALTER TABLE posts ADD COLUMN sentiment_score REAL")
-    conn.commit()
-    # Get posts without sentiment
-    c.execute("SELECT id, title, selftext FROM posts WHERE sentiment IS NULL")
-    posts = c.fetchall()
-    for post_id, title, selftext in posts:
-        text = f"{title} {selftext}"
-        sentiment, score = get_sentiment(text)
-        c.execute("UPDATE posts SET sentiment=?, sentiment_score=? WHERE id=?", (sentiment, score, post_id))
-        print(f"Updated {post_id} with sentiment {sentiment} ({score:.2f})")
-    conn.commit()
-    conn.close()
\ No newline at end of file
@@ -1,67 +1,288 @@
-import sqlite3
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import numpy as np
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
+from database_manager import get_connection
+from store_posts import create_db
+
+# ONNX Runtime is optional; when optimum is installed it replaces eager PyTorch for inference
+try:
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTOptimizer
+    from optimum.onnxruntime.configuration import AutoOptimizationConfig
+except ImportError:
+    ORTModelForSequenceClassification = None
+
+MODEL_NAME = "yiyanghkust/finbert-tone"
+ONNX_MODEL_DIR = "finbert-onnx"  # Exported and optimized ONNX model, cached alongside its tokenizer
+ONNX_FILE_NAME = "model_optimized.onnx"
+MAX_LENGTH = 512  # FinBERT's maximum sequence length in tokens
+BATCH_SIZE = 32  # Number of posts scored per forward pass
+WRITE_BATCH_SIZE = 500  # Number of posts length-sorted and committed together
+
+# The labels are in the order: Positive, Negative, Neutral for this model
+LABELS = ['positive', 'negative', 'neutral']
+SKIPPED_SENTIMENT = 'skip'  # Marks posts with no tickers so they aren't re-scanned every cycle
+
+def load_onnx_model():
+    """
+    Loads the O3-optimized ONNX export of FinBERT, exporting it on the first run.
+    """
+    if not os.path.exists(os.path.join(ONNX_MODEL_DIR, ONNX_FILE_NAME)):
+        print("Exporting FinBERT to ONNX (first run only)...")
+        ort_model = ORTModelForSequenceClassification.from_pretrained(MODEL_NAME, export=True)
+        optimizer = ORTOptimizer.from_pretrained(ort_model)
+        optimizer.optimize(save_dir=ONNX_MODEL_DIR, optimization_config=AutoOptimizationConfig.O3())
+        tokenizer.save_pretrained(ONNX_MODEL_DIR)
+    return ORTModelForSequenceClassification.from_pretrained(ONNX_MODEL_DIR, file_name=ONNX_FILE_NAME)
 
 # --- Model Loading (do this once) ---
 print("Loading FinBERT model...")
-tokenizer = AutoTokenizer.from_pretrained("yiyanghkust/finbert-tone")
-model = AutoModelForSequenceClassification.from_pretrained("yiyanghkust/finbert-tone")
-print("Model loaded.")
+tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+if ORTModelForSequenceClassification is not None:
+    # ONNX Runtime runs on the CPU execution provider
+    device = torch.device("cpu")
+    model = load_onnx_model()
+else:
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
+    model.eval()
+    if device.type == "cuda":
+        # Half precision halves the bytes moved per weight on the GPU
+        model = model.half().to(device)
+    else:
+        # Dynamic int8 quantization of the Linear layers for faster CPU inference
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+print(f"Model loaded on {device}.")
+# Cached token ids stay valid across model swaps as long as the vocabulary and truncation
+# length are unchanged, so the cache is keyed on those rather than on the model name
+TOKEN_CACHE_KEY = hashlib.sha1(
+    json.dumps([sorted(tokenizer.get_vocab().items()), MAX_LENGTH]).encode()
+).hexdigest()
 # ------------------------------------
 
+def encode(texts):
+    """
+    Tokenizes texts without padding, truncated to the model's max length.
+    """
+    return tokenizer(texts, truncation=True, max_length=MAX_LENGTH)["input_ids"]
+
+def predict(input_ids):
+    """
+    Scores tokenized texts with FinBERT. Sequences are sorted by length so each batch
+    is only padded to its own longest sequence. Returns (sentiment, score) tuples in input order.
+    """
+    results = [None] * len(input_ids)
+    order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]))
+    for start in range(0, len(order), BATCH_SIZE):
+        batch = order[start:start + BATCH_SIZE]
+        inputs = tokenizer.pad(
+            {"input_ids": [input_ids[i] for i in batch]}, padding="longest", return_tensors="pt"
+        ).to(device)
+        with torch.inference_mode():
+            probs = model(**inputs).logits.softmax(dim=-1)
+        scores, label_ids = probs.max(dim=-1)
+        for i, label_id, score in zip(batch, label_ids.tolist(), scores.tolist()):
+            results[i] = (LABELS[label_id], score)
+    return results
+
+def encode_cached(c, posts):
+    """
+    Tokenizes (post_id, text) pairs, reusing token ids cached in the post_tokens table.
+    Returns a list of token id lists in the same order as the input, plus the
+    post_tokens rows to cache for posts that had to be tokenized.
+    """
+    post_ids = [post_id for post_id, _ in posts]
+    placeholders = ",".join("?" * len(post_ids))
+    c.execute(
+        f"SELECT id, input_ids FROM post_tokens WHERE tokenizer = ? AND id IN ({placeholders})",
+        [TOKEN_CACHE_KEY, *post_ids]
+    )
+    cached = {post_id: np.frombuffer(blob, dtype=np.int32).tolist() for post_id, blob in c.fetchall()}
+
+    new_cache_rows = []
+    missing = [(post_id, text) for post_id, text in posts if post_id not in cached]
+    if missing:
+        encoded = encode([text for _, text in missing])
+        new_cache_rows = [
+            (post_id, TOKEN_CACHE_KEY, np.asarray(ids, dtype=np.int32).tobytes())
+            for (post_id, _), ids in zip(missing, encoded)
+        ]
+        cached.update((post_id, ids) for (post_id, _), ids in zip(missing, encoded))
+
+    return [cached[post_id] for post_id in post_ids], new_cache_rows
+
+def get_sentiments(texts):
+    """
+    Analyzes the sentiment of a list of texts using FinBERT.
+    Returns a list of (sentiment, score) tuples in the same order as the input.
+    """
+    return predict(encode(texts))
+
 def get_sentiment(text):
     """
     Analyzes the sentiment of a given text using FinBERT.
     """
-    # Truncate text to fit model's max length
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
-        # The labels are in the order: Positive, Negative, Neutral for this model
-        labels = ['positive', 'negative', 'neutral']
-        sentiment = labels[probs.argmax()]
-        score = probs.max().item()
-    return sentiment, score
+    return get_sentiments([text])[0]
 
-def analyze_and_update_db(db_name="reddit_posts.db"):
+def _run_worker(target, errors, stop, *args):
     """
-    Adds sentiment columns to the DB, then analyzes any posts that are missing sentiment.
+    Runs target(*args) on a worker thread, recording any exception in errors and setting
+    stop so the other threads wind down instead of waiting on it.
     """
-    conn = sqlite3.connect(db_name)
-    c = conn.cursor()
+    try:
+        target(*args)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+
+def _put_until_stopped(q, item, stop):
+    """Puts item on a bounded queue, giving up once stop is set. Returns whether it was put."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
 
-    # Add sentiment columns if they don't exist
+def _read_unanalyzed_posts(db_name, row_queue, stop):
+    """
+    Streams the posts that haven't been analyzed yet into row_queue, followed by None.
+    Stops early once stop is set.
+    """
+    conn = get_connection(db_name)
     try:
-        c.execute("ALTER TABLE posts ADD COLUMN sentiment TEXT")
-        c.execute("ALTER TABLE posts ADD COLUMN sentiment_score REAL")
-        print("Added sentiment columns to the database.")
-    except sqlite3.OperationalError:
-        print("Sentiment columns already exist.") # Columns already exist, which is fine
+        for row in conn.execute(
+            "SELECT id, title, selftext FROM posts "
+            "WHERE sentiment IS NULL AND tickers IS NOT NULL AND tickers <> ''"
+        ):
+            if not _put_until_stopped(row_queue, row, stop):
+                break
+    finally:
+        conn.close()
+        _put_until_stopped(row_queue, None, stop)
 
-    # Get posts that haven't been analyzed yet
-    c.execute("SELECT id, title, selftext FROM posts WHERE sentiment IS NULL")
-    posts_to_analyze = c.fetchall()
+def _iter_chunks(row_queue, chunk_size, stop):
+    """
+    Groups rows from row_queue into lists of up to chunk_size until None is received,
+    or until stop is set and the queue has run dry.
+    """
+    chunk = []
+    while True:
+        try:
+            row = row_queue.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if row is None:
+            break
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
-    if not posts_to_analyze:
-        print("No new posts to analyze.")
-        return
-
-    print(f"Found {len(posts_to_analyze)} posts to analyze...")
-    for post_id, title, selftext in posts_to_analyze:
-        text = f"{title}. {selftext}"
-        sentiment, score = get_sentiment(text)
-        
-        # Update the database with the new sentiment
+def _write_results(db_name, result_queue):
+    """
+    Commits queued (updates, new_cache_rows) batches until None is received.
+    """
+    conn = get_connection(db_name)
+    try:
+        c = conn.cursor()
+        while (item := result_queue.get()) is not None:
+            updates, new_cache_rows = item
+            c.executemany(
+                "INSERT OR REPLACE INTO post_tokens (id, tokenizer, input_ids) VALUES (?, ?, ?)",
+                new_cache_rows
+            )
+            c.executemany("UPDATE posts SET sentiment = ?, sentiment_score = ? WHERE id = ?", updates)
+            conn.commit()
+    finally:
+        conn.close()
+
+def analyze_and_update_db(db_name="reddit_posts.db", reanalyze=False):
+    """
+    Adds sentiment columns to the DB, then analyzes any posts that are missing sentiment.
+    With reanalyze=True (e.g. after swapping the model), every post with tickers is scored
+    again, reusing cached token ids where the tokenizer is unchanged.
+    """
+    # Ensure the table and its sentiment columns exist (no schema change if they already do)
+    create_db(db_name)
+
+    conn = get_connection(db_name)
+    c = conn.cursor()
+
+    if reanalyze:
         c.execute(
-            "UPDATE posts SET sentiment = ?, sentiment_score = ? WHERE id = ?",
-            (sentiment, score, post_id)
+            "UPDATE posts SET sentiment = NULL, sentiment_score = NULL WHERE sentiment <> ?",
+            (SKIPPED_SENTIMENT,)
         )
-        print(f"Updated post {post_id} with sentiment: {sentiment} ({score:.2f})")
+        print(f"Cleared sentiment on {c.rowcount} posts for re-analysis.")
+        # Token ids from any other tokenizer can never be hit again
+        c.execute("DELETE FROM post_tokens WHERE tokenizer <> ?", (TOKEN_CACHE_KEY,))
+        conn.commit()
 
+    # Posts without tickers never appear on the dashboard, so mark them instead of scoring them
+    c.execute(
+        "UPDATE posts SET sentiment = ? WHERE sentiment IS NULL AND (tickers IS NULL OR tickers = '')",
+        (SKIPPED_SENTIMENT,)
+    )
+    if c.rowcount > 0:
+        print(f"Skipped {c.rowcount} posts without tickers.")
     conn.commit()
-    conn.close()
-    print("Database updated successfully.")
+
+    # Rows stream in from a reader thread while results go out through a writer thread,
+    # each with its own connection (safe under WAL), so DB I/O overlaps with inference.
+    # A worker's exception is recorded in errors and re-raised here once both have stopped
+    row_queue = queue.Queue(maxsize=2 * WRITE_BATCH_SIZE)
+    result_queue = queue.Queue()
+    errors = []
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=_run_worker, args=(_read_unanalyzed_posts, errors, stop, db_name, row_queue, stop)
+    )
+    writer = threading.Thread(
+        target=_run_worker, args=(_write_results, errors, stop, db_name, result_queue)
+    )
+    reader.start()
+    writer.start()
+
+    analyzed = 0
+    try:
+        # Each chunk is scored (sorted by length internally) and committed in one transaction
+        for chunk in _iter_chunks(row_queue, WRITE_BATCH_SIZE, stop):
+            if errors:
+                break
+            input_ids, new_cache_rows = encode_cached(
+                c, [(post_id, f"{title}. {selftext}") for post_id, title, selftext in chunk]
+            )
+            results = predict(input_ids)
+            updates = [(sentiment, score, post_id) for (post_id, _, _), (sentiment, score) in zip(chunk, results)]
+            result_queue.put((updates, new_cache_rows))
+            analyzed += len(chunk)
+            print(f"Analyzed {analyzed} posts.")
+    finally:
+        # Unblocks the reader if analysis stopped early; the writer still commits what was queued
+        stop.set()
+        result_queue.put(None)
+        writer.join()
+        reader.join()
+        conn.close()
+
+    if errors:
+        raise errors[0]
+    if analyzed == 0:
+        print("No new posts to analyze.")
+    else:
+        print("Database updated successfully.")
 
 if __name__ == "__main__":
-    analyze_and_update_db()
\ No newline at end of file
+    # Pass --reanalyze to score every post again, e.g. after changing MODEL_NAME
+    analyze_and_update_db(reanalyze="--reanalyze" in sys.argv[1:])
\ No newline at end of file
@@ -1,9 +1,127 @@
 import yfinance as yf
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-import sqlite3
+from numba import njit
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import wraps
+import hashlib
+import os
+import threading
+import time
 
+from database_manager import get_shared_connection
+
+# Polars is optional; when installed it runs the sentiment/price join
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+CACHE_DIR = ".cache"  # On-disk cache of price data, one Parquet file per request
+FETCH_SIZE = 1000  # Rows fetched from SQLite per round trip
+
+# An index seek on post_tickers(ticker, created_utc), matching the ticker exactly.
+# Kept at module scope so the shared connection's statement cache reuses the parsed query
+SENTIMENT_QUERY = """
+SELECT p.created_utc, p.sentiment_score, p.sentiment, p.upvotes
+FROM post_tickers t
+JOIN posts p ON p.id = t.post_id
+WHERE t.ticker = ? AND t.created_utc >= ?
+ORDER BY t.created_utc
+"""
+
+def _remove_expired_intraday_entries(intraday_ttl):
+    """Deletes intraday cache files older than intraday_ttl; their keys rarely recur."""
+    now = time.time()
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".intraday.parquet"):
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                if now - os.path.getmtime(path) >= intraday_ttl.total_seconds():
+                    os.remove(path)
+            except FileNotFoundError:
+                pass  # Removed by another session
+
+def cached(intraday_ttl=timedelta(hours=1), memory_size=128):
+    """
+    Cache a price fetcher's DataFrame results on disk as Parquet files.
+    
+    Entries are keyed by an MD5 of the function name, ticker and date range. Ranges that
+    had already ended when they were fetched never change, so they are kept indefinitely;
+    ranges that were still open (intraday entries) expire after intraday_ttl, and expired
+    intraday files are deleted whenever a new entry is written. Files are written to a
+    temporary name and renamed, so concurrent readers never see a partial file. Empty
+    results (fetch errors) are not cached. The most recently used entries are also kept in
+    memory, so repeated calls within the process skip the Parquet read; callers always get
+    their own copy.
+    
+    Args:
+        intraday_ttl (timedelta): Lifetime of entries whose range includes today
+        memory_size (int): Number of entries kept in the in-memory LRU
+    
+    Returns:
+        function: Decorator for functions called as func(ticker, start_date, end_date=None)
+    """
+    def decorator(func):
+        memory = OrderedDict()  # (ticker, start_day, end_day) -> (DataFrame, expires_at)
+        lock = threading.Lock()
+        
+        def remember(memory_key, result, expires_at):
+            with lock:
+                memory[memory_key] = (result, expires_at)
+                memory.move_to_end(memory_key)
+                if len(memory) > memory_size:
+                    memory.popitem(last=False)
+            return result.copy()
+        
+        @wraps(func)
+        def wrapper(ticker, start_date, end_date=None):
+            start_day = pd.Timestamp(start_date).date()
+            end_day = pd.Timestamp(end_date).date() if end_date is not None else date.today()
+            memory_key = (ticker, start_day, end_day)
+            
+            with lock:
+                entry = memory.get(memory_key)
+                if entry is not None:
+                    memory.move_to_end(memory_key)
+            if entry is not None and time.time() < entry[1]:
+                return entry[0].copy()
+            
+            key = hashlib.md5(f"{func.__name__}|{ticker}|{start_day}|{end_day}".encode()).hexdigest()
+            complete_path = os.path.join(CACHE_DIR, f"{key}.parquet")
+            intraday_path = os.path.join(CACHE_DIR, f"{key}.intraday.parquet")
+            
+            try:
+                return remember(memory_key, pd.read_parquet(complete_path), float('inf'))
+            except FileNotFoundError:
+                pass
+            try:
+                expires_at = os.path.getmtime(intraday_path) + intraday_ttl.total_seconds()
+                if time.time() < expires_at:
+                    return remember(memory_key, pd.read_parquet(intraday_path), expires_at)
+                os.remove(intraday_path)
+            except FileNotFoundError:
+                pass  # Not cached, or removed by another session
+            
+            # The range is complete once the day it ends on is over
+            is_complete = end_day < date.today()
+            result = func(ticker, start_date, end_date)
+            if not result.empty:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                path = complete_path if is_complete else intraday_path
+                # Write to a temporary file first so other sessions never read a partial file
+                partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                result.to_parquet(partial_path)
+                os.replace(partial_path, path)
+                _remove_expired_intraday_entries(intraday_ttl)
+                expires_at = float('inf') if is_complete else time.time() + intraday_ttl.total_seconds()
+                return remember(memory_key, result, expires_at)
+            return result
+        return wrapper
+    return decorator
+
+@cached()
 def get_stock_price_data(ticker, start_date, end_date=None):
     """
     Fetch stock price data for a given ticker and date range.
@@ -45,21 +163,100 @@ def calculate_price_changes(price_data):
         price_data (pandas.DataFrame): Stock price data from yfinance
     
     Returns:
-        pandas.DataFrame: Price data with additional columns for changes
+        pandas.DataFrame: Copy of the price data with additional columns for changes
     """
     if price_data.empty:
         return price_data
     
-    # Calculate daily returns
-    price_data['Daily_Return'] = price_data['Close'].pct_change()
+    # One pass over the closing prices: change from the previous day, then the return
+    close = price_data['Close'].to_numpy(dtype=np.float64)
+    change = np.empty_like(close)
+    change[:1] = np.nan
+    np.subtract(close[1:], close[:-1], out=change[1:])
+    
+    daily_return = np.empty_like(close)
+    daily_return[:1] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(change[1:], close[:-1], out=daily_return[1:])
+    
+    # Differences are taken in float64, then stored as float32 to halve the bytes later
+    # stages move. The percentage change scales the same return array
+    daily_return = daily_return.astype(np.float32)
+    
+    # Added in one assign rather than three column insertions
+    return price_data.assign(
+        Daily_Return=daily_return,
+        Price_Change=change.astype(np.float32),
+        Price_Change_Pct=daily_return * 100
+    )
+
+def aggregate_daily_sentiment(day_buckets, scores):
+    """
+    Calculate daily average sentiment and mention counts with np.bincount.
+    
+    Args:
+        day_buckets (numpy.ndarray): Day number of each post (days since the epoch)
+        scores (numpy.ndarray): Sentiment score of each post, NaN if not analyzed
     
-    # Calculate price change from previous day
-    price_data['Price_Change'] = price_data['Close'] - price_data['Close'].shift(1)
+    Returns:
+        tuple: (first_day, daily_sentiment, daily_counts) covering every day from first_day
+            onward, with days that have no scores linearly interpolated
+    """
+    day_buckets = np.asarray(day_buckets, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    first_day = day_buckets.min()
+    days = day_buckets - first_day
+    
+    # Per-day post counts, score sums and scored-post counts, each one bincount pass
+    scored = ~np.isnan(scores)
+    counts = np.bincount(days)
+    sums = np.bincount(days, weights=np.where(scored, scores, 0.0), minlength=len(counts))
+    scored_counts = np.bincount(days, weights=scored, minlength=len(counts))
+    
+    # Daily means, linearly interpolating across days without scores. Days before the
+    # first score stay NaN; trailing gaps carry the last mean forward, as pandas' interpolate does
+    means = np.full(len(counts), np.nan)
+    scored_days = np.flatnonzero(scored_counts)
+    if len(scored_days):
+        all_days = np.arange(scored_days[0], len(counts))
+        means[scored_days[0]:] = np.interp(
+            all_days, scored_days, sums[scored_days] / scored_counts[scored_days]
+        )
+    return first_day, means, counts
+
+def _join_sentiment_and_prices(daily_sentiment, price_data):
+    """
+    Inner-join daily sentiment with price data on date using a Polars lazy query.
+    
+    Args:
+        daily_sentiment (pandas.Series): Daily average sentiment with date index
+        price_data (pandas.DataFrame): Price data from calculate_price_changes
     
-    # Calculate percentage change
-    price_data['Price_Change_Pct'] = price_data['Close'].pct_change() * 100
+    Returns:
+        pandas.DataFrame: Dates with both sentiment and price data, without NaN values
+    """
+    sentiment = pl.LazyFrame({
+        # Join keys must share a datetime resolution
+        'date': daily_sentiment.index.astype(price_data.index.dtype),
+        'Sentiment_Score': daily_sentiment.to_numpy()
+    })
+    prices = pl.LazyFrame({
+        'date': price_data.index,
+        'Stock_Price': price_data['Close'].to_numpy(dtype=np.float32),
+        'Daily_Return': price_data['Daily_Return'].to_numpy(),
+        'Price_Change_Pct': price_data['Price_Change_Pct'].to_numpy()
+    })
+    combined = (
+        sentiment.join(prices, on='date', how='inner')
+        .fill_nan(None)
+        .drop_nulls()
+        .sort('date')
+        .collect()
+    )
     
-    return price_data
+    combined_df = combined.to_pandas().set_index('date')
+    combined_df.index.name = None
+    return combined_df
 
 def get_sentiment_price_comparison(ticker, db_name="reddit_posts.db", days_back=30):
     """
@@ -73,39 +270,42 @@ def get_sentiment_price_comparison(ticker, db_name="reddit_posts.db", days_back=
     Returns:
         tuple: (sentiment_df, price_df, combined_df)
     """
-    # Get sentiment data from database
-    conn = sqlite3.connect(db_name)
-    
     # Get posts for this ticker within the date range
     start_date = datetime.now() - timedelta(days=days_back)
     start_timestamp = int(start_date.timestamp())
     
-    query = """
-    SELECT created_utc, sentiment_score, sentiment, upvotes
-    FROM posts 
-    WHERE tickers LIKE ? AND created_utc >= ?
-    ORDER BY created_utc
-    """
-    
-    sentiment_df = pd.read_sql_query(
-        query, 
-        conn, 
-        params=[f'%{ticker}%', start_timestamp]
+    cursor = get_shared_connection(db_name).cursor()
+    cursor.arraysize = FETCH_SIZE
+    cursor.execute(SENTIMENT_QUERY, (ticker, start_timestamp))
+    
+    # Stream fetchmany batches into a structured array. Unanalyzed posts have a NULL score,
+    # and older databases can have NULL upvotes; both read as NaN
+    rows = np.fromiter(
+        (
+            (created_utc, np.nan if score is None else score, sentiment,
+             np.nan if upvotes is None else upvotes)
+            for batch in iter(cursor.fetchmany, [])
+            for created_utc, score, sentiment, upvotes in batch
+        ),
+        dtype=[('created_utc', 'i8'), ('sentiment_score', 'f8'), ('sentiment', 'O'), ('upvotes', 'f8')]
     )
+    cursor.close()
     
-    conn.close()
-    
-    if sentiment_df.empty:
+    if rows.size == 0:
         print(f"No sentiment data found for {ticker}")
         return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
     
-    # Convert timestamps to datetime (timezone-naive)
-    sentiment_df['date'] = pd.to_datetime(sentiment_df['created_utc'], unit='s')
-    sentiment_df.set_index('date', inplace=True)
+    # Daily averages straight from the arrays, interpolating days without scores
+    first_day, daily_means, _ = aggregate_daily_sentiment(
+        rows['created_utc'] // 86400, rows['sentiment_score']
+    )
+    days = np.arange(first_day, first_day + len(daily_means))
+    daily_sentiment = pd.Series(
+        daily_means.astype(np.float32), index=pd.to_datetime(days * 86400, unit='s')
+    )
     
-    # Resample sentiment data to daily averages
-    daily_sentiment = sentiment_df['sentiment_score'].resample('D').mean()
-    daily_sentiment = daily_sentiment.interpolate()  # Fill gaps
+    sentiment_df = pd.DataFrame(rows, index=pd.to_datetime(rows['created_utc'], unit='s'))
+    sentiment_df.index.name = 'date'
     
     # Get price data for the same period
     price_data = get_stock_price_data(ticker, start_date)
@@ -115,18 +315,41 @@ def get_sentiment_price_comparison(ticker, db_name="reddit_posts.db", days_back=
         return sentiment_df, pd.DataFrame(), pd.DataFrame()
     
     # Combine sentiment and price data
-    combined_df = pd.DataFrame({
-        'Sentiment_Score': daily_sentiment,
-        'Stock_Price': price_data['Close'],
-        'Daily_Return': price_data['Daily_Return'],
-        'Price_Change_Pct': price_data['Price_Change_Pct']
-    })
-    
-    # Remove rows with NaN values
-    combined_df = combined_df.dropna()
+    if pl is not None:
+        combined_df = _join_sentiment_and_prices(daily_sentiment, price_data)
+    else:
+        # Align prices to the sentiment days once (days without trading become NaN),
+        # then build the frame from the aligned arrays
+        dates = daily_sentiment.index.astype(price_data.index.dtype)
+        prices = price_data[['Close', 'Daily_Return', 'Price_Change_Pct']].reindex(dates)
+        columns = {
+            'Sentiment_Score': daily_sentiment.to_numpy(),
+            'Stock_Price': prices['Close'].to_numpy(dtype=np.float32),
+            'Daily_Return': prices['Daily_Return'].to_numpy(),
+            'Price_Change_Pct': prices['Price_Change_Pct'].to_numpy()
+        }
+        
+        # Remove rows with NaN values, from one mask over all four columns; the
+        # correlation and accuracy calculations rely on combined_df being NaN-free
+        valid = ~np.logical_or.reduce([np.isnan(values) for values in columns.values()])
+        combined_df = pd.DataFrame(
+            {name: values[valid] for name, values in columns.items()},
+            index=dates[valid]
+        )
     
     return sentiment_df, price_data, combined_df
 
+def _corrcoef_columns(*columns):
+    """
+    Pearson correlation matrix of equal-length, NaN-free 1-D arrays.
+    Entries are NaN where a column is constant or there are fewer than two rows.
+    """
+    data = np.column_stack(columns)
+    if len(data) < 2:
+        return np.full((len(columns), len(columns)), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.corrcoef(data, rowvar=False)
+
 def calculate_sentiment_price_correlation(combined_df):
     """
     Calculate correlation between sentiment and price movements.
@@ -140,18 +363,23 @@ def calculate_sentiment_price_correlation(combined_df):
     if combined_df.empty or len(combined_df) < 2:
         return {}
     
-    correlations = {}
-    
-    # Calculate correlations
-    correlations['sentiment_price_corr'] = combined_df['Sentiment_Score'].corr(combined_df['Stock_Price'])
-    correlations['sentiment_return_corr'] = combined_df['Sentiment_Score'].corr(combined_df['Daily_Return'])
-    correlations['sentiment_change_corr'] = combined_df['Sentiment_Score'].corr(combined_df['Price_Change_Pct'])
-    
-    # Calculate lagged correlations (sentiment today vs price tomorrow)
-    if len(combined_df) > 1:
-        sentiment_lagged = combined_df['Sentiment_Score'].shift(1)
-        correlations['sentiment_lagged_return_corr'] = sentiment_lagged.corr(combined_df['Daily_Return'])
-        correlations['sentiment_lagged_change_corr'] = sentiment_lagged.corr(combined_df['Price_Change_Pct'])
+    sentiment = combined_df['Sentiment_Score'].to_numpy()
+    price = combined_df['Stock_Price'].to_numpy()
+    daily_return = combined_df['Daily_Return'].to_numpy()
+    price_change_pct = combined_df['Price_Change_Pct'].to_numpy()
+    
+    # One correlation matrix for the same-day pairs, and one for the lagged pairs
+    # (sentiment today vs price tomorrow), instead of a separate .corr() per pair
+    same_day = _corrcoef_columns(sentiment, price, daily_return, price_change_pct)
+    lagged = _corrcoef_columns(sentiment[:-1], daily_return[1:], price_change_pct[1:])
+    
+    correlations = {
+        'sentiment_price_corr': same_day[0, 1],
+        'sentiment_return_corr': same_day[0, 2],
+        'sentiment_change_corr': same_day[0, 3],
+        'sentiment_lagged_return_corr': lagged[0, 1],
+        'sentiment_lagged_change_corr': lagged[0, 2],
+    }
     
     # Calculate R-squared values
     correlations['sentiment_price_r2'] = correlations['sentiment_price_corr'] ** 2
@@ -159,6 +387,31 @@ def calculate_sentiment_price_correlation(combined_df):
     
     return correlations
 
+@njit(cache=True)
+def _prediction_accuracy_kernel(sentiment_lagged, price_change_pct, threshold):
+    correct = true_positive = predicted_up = actual_up = total = 0
+    
+    # Single pass: directions in {-1, 0, 1}, where moves within the threshold
+    # (or sentiment exactly 0.5) count as 0, and pairs with a NaN are skipped
+    for i in range(price_change_pct.shape[0]):
+        sentiment = sentiment_lagged[i]
+        change = price_change_pct[i]
+        if np.isnan(sentiment) or np.isnan(change):
+            continue
+        price_direction = 1 if change > threshold else (-1 if change < -threshold else 0)
+        sentiment_direction = 1 if sentiment > 0.5 else (-1 if sentiment < 0.5 else 0)
+        
+        total += 1
+        if sentiment_direction == price_direction:
+            correct += 1
+        if sentiment_direction == 1:
+            predicted_up += 1
+            if price_direction == 1:
+                true_positive += 1
+        if price_direction == 1:
+            actual_up += 1
+    return correct, true_positive, predicted_up, actual_up, total
+
 def get_prediction_accuracy(combined_df, threshold=0.02):
     """
     Calculate how well sentiment predicts price direction.
@@ -173,29 +426,22 @@ def get_prediction_accuracy(combined_df, threshold=0.02):
     if combined_df.empty or len(combined_df) < 2:
         return {}
     
-    # Create lagged sentiment (sentiment today predicts price tomorrow)
-    combined_df['Sentiment_Lagged'] = combined_df['Sentiment_Score'].shift(1)
-    combined_df['Price_Direction'] = np.where(combined_df['Price_Change_Pct'] > threshold, 1, 
-                                             np.where(combined_df['Price_Change_Pct'] < -threshold, -1, 0))
-    combined_df['Sentiment_Direction'] = np.where(combined_df['Sentiment_Lagged'] > 0.5, 1,
-                                                 np.where(combined_df['Sentiment_Lagged'] < 0.5, -1, 0))
-    
-    # Remove NaN values
-    df_clean = combined_df.dropna()
+    # Lagged sentiment (sentiment today predicts price tomorrow), aligned by slicing
+    correct_predictions, true_positive, positive_predictions, actual_positive, total_predictions = (
+        _prediction_accuracy_kernel(
+            np.ascontiguousarray(combined_df['Sentiment_Score'].to_numpy(dtype=np.float32)[:-1]),
+            np.ascontiguousarray(combined_df['Price_Change_Pct'].to_numpy(dtype=np.float32)[1:]),
+            threshold
+        )
+    )
     
-    if len(df_clean) == 0:
+    if total_predictions == 0:
         return {}
     
     # Calculate accuracy metrics
-    correct_predictions = (df_clean['Sentiment_Direction'] == df_clean['Price_Direction']).sum()
-    total_predictions = len(df_clean)
-    accuracy = correct_predictions / total_predictions if total_predictions > 0 else 0
+    accuracy = correct_predictions / total_predictions
     
     # Calculate precision and recall for positive predictions
-    positive_predictions = (df_clean['Sentiment_Direction'] == 1).sum()
-    actual_positive = (df_clean['Price_Direction'] == 1).sum()
-    true_positive = ((df_clean['Sentiment_Direction'] == 1) & (df_clean['Price_Direction'] == 1)).sum()
-    
     precision = true_positive / positive_predictions if positive_predictions > 0 else 0
     recall = true_positive / actual_positive if actual_positive > 0 else 0
     
@@ -1,31 +1,75 @@
 # putting the posts in DB script
 
-import sqlite3
+from database_manager import get_shared_connection
+
+# Columns added after the original schema, created on older databases by create_db
+SENTIMENT_COLUMNS = {
+    "sentiment": "TEXT",
+    "sentiment_score": "REAL",
+}
 
 def create_db(db_name="reddit_posts.db"):
-    conn = sqlite3.connect(db_name)
+    conn = get_shared_connection(db_name)
     c = conn.cursor()
+    # Clustered on the post id, so id lookups and joins skip the separate rowid B-tree
     c.execute('''
         CREATE TABLE IF NOT EXISTS posts (
             id TEXT PRIMARY KEY,
             title TEXT,
             selftext TEXT,
             author TEXT,
-            created_utc INTEGER,
+            created_utc INTEGER NOT NULL,
             upvotes INTEGER,
-            tickers TEXT
+            tickers TEXT,
+            sentiment TEXT,
+            sentiment_score REAL
+        ) WITHOUT ROWID
+    ''')
+    # Only alter databases created before the sentiment columns were part of the schema
+    c.execute("PRAGMA table_info(posts)")
+    existing_columns = {col[1] for col in c.fetchall()}
+    for column, column_type in SENTIMENT_COLUMNS.items():
+        if column not in existing_columns:
+            c.execute(f"ALTER TABLE posts ADD COLUMN {column} {column_type}")
+    # Lets the retention cleanup range-seek on post age instead of scanning the table
+    c.execute("CREATE INDEX IF NOT EXISTS idx_created_utc ON posts(created_utc)")
+    # One row per (post, ticker), so ticker lookups are an index seek instead of a LIKE scan
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_tickers'")
+    needs_backfill = c.fetchone() is None
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS post_tickers (
+            post_id TEXT,
+            ticker TEXT,
+            created_utc INTEGER,
+            PRIMARY KEY (post_id, ticker)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_post_tickers_ticker ON post_tickers(ticker, created_utc)")
+    # Lets the retention cleanup range-seek on post age here too
+    c.execute("CREATE INDEX IF NOT EXISTS idx_post_tickers_created_utc ON post_tickers(created_utc)")
+    if needs_backfill:
+        # Split the comma-separated tickers of posts stored before the table existed
+        c.execute("SELECT id, tickers, created_utc FROM posts WHERE tickers IS NOT NULL")
+        c.executemany(
+            "INSERT OR IGNORE INTO post_tickers (post_id, ticker, created_utc) VALUES (?, ?, ?)",
+            [(post_id, ticker.strip(), created_utc)
+             for post_id, tickers, created_utc in c.fetchall()
+             for ticker in tickers.split(',') if ticker.strip()]
+        )
+    # Token ids cached by the sentiment analyzer, keyed by post id and tokenizer
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS post_tokens (
+            id TEXT,
+            tokenizer TEXT,
+            input_ids BLOB,
+            PRIMARY KEY (id, tokenizer)
         )
     ''')
     conn.commit()
-    conn.close()
 
-def insert_post(post, tickers, db_name="reddit_posts.db"):
-    conn = sqlite3.connect(db_name)
-    c = conn.cursor()
-    c.execute('''
-        INSERT OR IGNORE INTO posts (id, title, selftext, author, created_utc, upvotes, tickers)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (
+def _post_row(post, tickers):
+    """Builds the posts table row for a Reddit submission."""
+    return (
         post.id,
         post.title,
         getattr(post, 'selftext', ''),
@@ -33,8 +77,26 @@ def insert_post(post, tickers, db_name="reddit_posts.db"):
         int(post.created_utc),
         int(post.score),
         ",".join(tickers)
-    ))
-    rows_affected = c.rowcount
-    conn.commit()
-    conn.close()
+    )
+
+def insert_posts(posts_with_tickers, db_name="reddit_posts.db"):
+    """
+    Inserts a batch of (post, tickers) pairs in a single transaction.
+    Returns the number of new rows (posts already in the database are ignored).
+    """
+    conn = get_shared_connection(db_name)
+    # One transaction (and with WAL, no fsync) for the whole batch
+    with conn:
+        c = conn.executemany('''
+            INSERT OR IGNORE INTO posts (id, title, selftext, author, created_utc, upvotes, tickers)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [_post_row(post, tickers) for post, tickers in posts_with_tickers])
+        rows_affected = c.rowcount
+        conn.executemany(
+            "INSERT OR IGNORE INTO post_tickers (post_id, ticker, created_utc) VALUES (?, ?, ?)",
+            [(post.id, ticker, int(post.created_utc)) for post, tickers in posts_with_tickers for ticker in tickers]
+        )
     return rows_affected
+
+def insert_post(post, tickers, db_name="reddit_posts.db"):
+    return insert_posts([(post, tickers)], db_name)